@@ -1,3 +1,6 @@
+import threading
+
+import cv2
 import numpy as np
 import pyautogui
 import gymnasium as gym
@@ -8,6 +11,24 @@ from typing import Optional
 from executor import MacExecutor
 
 
+_mss = threading.local()
+
+
+def get_sct():
+    """Один экземпляр mss на поток: создаётся при первом вызове и дальше переиспользуется."""
+    sct = getattr(_mss, "sct", None)
+    if sct is None:
+        sct = _mss.sct = mss()
+    return sct
+
+
+def close_sct():
+    """Закрыть экземпляр mss текущего потока, если он был создан."""
+    sct = getattr(_mss, "sct", None)
+    if sct is not None:
+        _mss.sct = None
+        sct.close()
+
 
 class ComputerUseEnv(gym.Env):
     def __init__(self, new_size=(1280, 720), verbose=False, monitor_index=1, fps=20, obs_prev_n_actions=10):
@@ -17,19 +38,19 @@ class ComputerUseEnv(gym.Env):
         self.verbose = verbose
 
         self.monitor_index = monitor_index
-        self.sct = mss()
-        try:
-            self.monitor = self.sct.monitors[self.monitor_index]
-        except Exception:
-            self.monitor = self.sct.monitors[1]
+        # mss не храним на объекте: экземпляр потока берётся из get_sct() при первом снимке
+        self.monitor: Optional[dict] = None
 
+        self._target_size = tuple(new_size)  # (W, H) — кадры уменьшаются до него прямо при захвате
         self.screen_size = pyautogui.size()
         self.screen_size_scalers = (self.screen_size.width / new_size[0], self.screen_size.height / new_size[1])
-        self.observation_space = Box(low=0, high=255, shape=(3, new_size[0], new_size[1]), dtype=np.uint8)
+        self.observation_space = Box(low=0, high=255, shape=(new_size[1], new_size[0], 3), dtype=np.uint8)  # (H, W, C)
         self.action_space = Dict({
             "move_mouse": Box(low=np.array([0, 0]), high=np.array(new_size)),
             "use_action": Discrete(self.executor.n_discrete)
         })
+        # буфер кадров (B(2), H, W, C(3)): [0] — предыдущий, [1] — текущий; переиспользуется каждый шаг
+        self._obs_buf = np.empty((2, new_size[1], new_size[0], 3), dtype=np.uint8)
 
         self.reset()
 
@@ -38,11 +59,26 @@ class ComputerUseEnv(gym.Env):
             print(f"Used action: {str(action)}")
 
     def _get_obs(self, prev_img=None, prompt="", prev_n_actions=[]):
-        img = np.array(self.sct.grab(self.monitor))[:, :, :3]
+        """Снимок экрана → наблюдение. obs["frames"] — view на self._obs_buf: следующий вызов его перезапишет,
+        поэтому наружу (reset/step) отдаётся копия."""
+        self.executor.flush()  # накопленное движение мыши должно попасть в кадр
+        sct = get_sct()
+        if self.monitor is None:
+            try:
+                self.monitor = sct.monitors[self.monitor_index]
+            except Exception:
+                self.monitor = sct.monitors[1]
+        sct_img = sct.grab(self.monitor)
+        # BGRA-буфер mss оборачиваем без копии
+        bgra = np.frombuffer(sct_img.raw, dtype=np.uint8).reshape(sct_img.height, sct_img.width, 4)
         if prev_img is not None:
-            batch = np.stack([prev_img, img], axis=0)  # (B(2), H, W, C(3))
-        else:
-            batch = np.expand_dims(img, axis=0)
+            self._obs_buf[0] = prev_img  # сначала prev: он может быть view на self._obs_buf[1]
+        if (sct_img.width, sct_img.height) != self._target_size:
+            # INTER_AREA на полном разрешении, дальше все стадии работают с уменьшенным кадром
+            bgra = cv2.resize(bgra, self._target_size, interpolation=cv2.INTER_AREA)
+        # BGRA → RGB одной операцией сразу в буфер наблюдений
+        cv2.cvtColor(bgra, cv2.COLOR_BGRA2RGB, dst=self._obs_buf[1])
+        batch = self._obs_buf if prev_img is not None else self._obs_buf[1:]
 
         obs = {
             "frames": batch,
@@ -55,8 +91,15 @@ class ComputerUseEnv(gym.Env):
         super().reset(seed=seed)
         self.executor.release_all()
         observation = self._get_obs()
+        # копия на границе gym API: вызывающий может хранить obs (replay buffer, prev_obs)
+        observation["frames"] = observation["frames"].copy()
         info = {}
         return observation, info
 
     def step(self, action):
         pass
+
+    def close(self):
+        self.executor.close()  # иначе поток исполнителя и сам исполнитель живут до конца процесса
+        close_sct()
+        super().close()
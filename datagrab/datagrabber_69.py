@@ -2,51 +2,195 @@
 from __future__ import annotations
 
 import argparse
-import csv
 import json
 import os
 import platform
+import queue
 import signal
 import threading
 import time
-from collections import deque
-from dataclasses import dataclass
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Deque, Dict, Optional, Tuple
+from typing import Dict, NamedTuple, Optional, Tuple
 
 from mss import mss
 from PIL import Image
 from pynput import keyboard, mouse
 
+try:
+    import imageio_ffmpeg  # type: ignore
+except Exception:  # нужен только для --format mkv
+    imageio_ffmpeg = None  # type: ignore
 
-@dataclass
-class Event:
-    ts: float
-    etype: str
-    payload: Dict
 
+CSV_BUFFER_SIZE = 1 << 20
+CSV_FLUSH_INTERVAL_S = 1.0  # flush не чаще раза в секунду
+STOP_FILE_CHECK_INTERVAL_S = 1.0  # .stop — аварийный путь, опрашиваем раз в секунду
+PNG_WORKERS = 2
+PNG_MAX_PENDING = 8  # сколько кадров может ждать кодирования, дальше захват ждёт
+FRAME_FORMATS = ("png", "mkv")
+VIDEO_FILE = "frames.mkv"
+
+# имя клавиши pynput → модификатор в колонке modifiers
+MODIFIER_MAP = {
+    "shift": "shift", "shift_l": "shift", "shift_r": "shift",
+    "ctrl": "ctrl", "ctrl_l": "ctrl", "ctrl_r": "ctrl",
+    "alt": "alt", "alt_l": "alt", "alt_r": "alt", "option": "alt",
+    "cmd": "cmd", "cmd_l": "cmd", "cmd_r": "cmd", "super": "cmd",
+}
+
+
+def _encode_and_write(bgra: bytearray, size: Tuple[int, int], path: str,
+                      out_size: Optional[Tuple[int, int]] = None) -> None:
+    # zlib и ресемплинг внутри PIL отпускают GIL, поэтому потоки реально работают параллельно
+    im = Image.frombuffer("RGB", size, bgra, "raw", "BGRX", 0, 1)
+    if out_size is not None and out_size != im.size:
+        im = im.resize(out_size, Image.Resampling.BOX)  # BOX ≈ INTER_AREA: дёшево и без муара при уменьшении
+    im.save(path, format="PNG", optimize=False, compress_level=1)
+
+
+def parse_size(value: str) -> Tuple[int, int]:
+    """'1280x720' → (1280, 720)."""
+    try:
+        w, h = (int(v) for v in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидали размер вида 1280x720, получили {value!r}")
+    if w <= 0 or h <= 0:
+        raise argparse.ArgumentTypeError(f"размер должен быть положительным: {value!r}")
+    return w, h
+
+
+CSV_FIELDS = (
+    "row_type", "frame_id", "time_s", "event_type", "frame_path",
+    "x", "y", "dx", "dy", "key", "key_code", "mouse_button", "action", "scroll_dx", "scroll_dy", "modifiers",
+)
+CSV_HEADER = ",".join(CSV_FIELDS) + "\r\n"
+_FRAME_ROW_PAD = "," * (len(CSV_FIELDS) - 5)
 
-class SafeDeque:
-    def __init__(self):
-        self._dq: Deque[Event] = deque()
-        self._lock = threading.Lock()
 
-    def append(self, item: Event):
-        with self._lock:
-            self._dq.append(item)
+def _csv_field(v) -> str:
+    """Поле CSV с минимальным экранированием (как csv.QUOTE_MINIMAL); None → пусто."""
+    if v is None:
+        return ""
+    s = str(v)
+    if "," in s or '"' in s or "\n" in s or "\r" in s:
+        return '"' + s.replace('"', '""') + '"'
+    return s
+
+
+class Event(NamedTuple):
+    ts: float
+    etype: str
+    x: Optional[int] = None
+    y: Optional[int] = None
+    key: Optional[str] = None
+    key_code: Optional[int] = None
+    button: Optional[str] = None
+    action: Optional[str] = None
+    scroll_dx: Optional[int] = None
+    scroll_dy: Optional[int] = None
+    modifiers: Optional[str] = None
+
+
+def coalesce_mouse_moves(events: list[Event]) -> list[Event]:
+    """Схлопывает серии mouse_move до последнего; клики, скролл и клавиши сохраняются."""
+    out: list[Event] = []
+    last_move: Optional[Event] = None
+    for ev in events:
+        if ev.etype == "mouse_move":
+            last_move = ev
+            continue
+        if last_move is not None:
+            out.append(last_move)
+            last_move = None
+        out.append(ev)
+    if last_move is not None:
+        out.append(last_move)
+    return out
+
+
+_mss = threading.local()
+
+
+def get_sct():
+    """Один экземпляр mss на поток: создаётся при первом вызове и дальше переиспользуется."""
+    sct = getattr(_mss, "sct", None)
+    if sct is None:
+        sct = _mss.sct = mss()
+    return sct
+
+
+def close_sct():
+    """Закрыть экземпляр mss текущего потока, если он был создан."""
+    sct = getattr(_mss, "sct", None)
+    if sct is not None:
+        _mss.sct = None
+        sct.close()
+
+
+class EventQueue:
+    """
+    Очередь событий: слушатели pynput пишут из своих потоков, цикл записи читает.
+    Держится на queue.SimpleQueue (реализована на C), поэтому на пути продюсера
+    нет питоновского Lock. Читатель один, так что событие позже границы кадра
+    просто откладывается до следующего тика.
+    """
+    def __init__(self):
+        self._q: queue.SimpleQueue[Event] = queue.SimpleQueue()
+        self._stash: Optional[Event] = None
+        self.append = self._q.put_nowait
 
     def pop_all_upto(self, ts_cutoff: float) -> list[Event]:
         out = []
-        with self._lock:
-            while self._dq and self._dq[0].ts <= ts_cutoff:
-                out.append(self._dq.popleft())
+        ev = self._stash
+        if ev is not None:
+            if ev.ts > ts_cutoff:
+                return out
+            self._stash = None
+            out.append(ev)
+        get = self._q.get_nowait
+        while True:
+            try:
+                ev = get()
+            except queue.Empty:
+                break
+            if ev.ts > ts_cutoff:
+                self._stash = ev
+                break
+            out.append(ev)
         return out
 
     def drain_all(self) -> list[Event]:
-        with self._lock:
-            out = list(self._dq)
-            self._dq.clear()
-        return out
+        out = [self._stash] if self._stash is not None else []
+        self._stash = None
+        get = self._q.get_nowait
+        while True:
+            try:
+                out.append(get())
+            except queue.Empty:
+                return out
+
+
+class ModifierSet:
+    """Нажатые модификаторы; строка для колонки modifiers пересчитывается только при изменении набора."""
+    ORDER = ("cmd", "ctrl", "alt", "shift")
+
+    def __init__(self):
+        self._set: set[str] = set()
+        self.mods_str = ""
+
+    def add(self, mod: str):
+        if mod not in self._set:
+            self._set.add(mod)
+            self._update()
+
+    def discard(self, mod: str):
+        if mod in self._set:
+            self._set.discard(mod)
+            self._update()
+
+    def _update(self):
+        self.mods_str = "+".join(m for m in self.ORDER if m in self._set)
 
 
 class Recorder:
@@ -61,6 +205,9 @@ class Recorder:
         dev: bool = False,
         max_duration: Optional[float] = None,
         operator: str = "",
+        coalesce_moves: bool = False,
+        frame_format: str = "png",
+        capture_size: Optional[Tuple[int, int]] = None,
     ):
         self.dataset_root = dataset_root
         self.rec_id = rec_id or f"rec_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
@@ -72,30 +219,59 @@ class Recorder:
         self.dev = dev
         self.max_duration = max_duration
         self.operator = operator.strip()
+        self.coalesce_moves = coalesce_moves
+        self.frame_format = frame_format if frame_format in FRAME_FORMATS else "png"
+        self.capture_size = capture_size  # None — сохраняем в родном разрешении
+        if self.frame_format == "mkv" and imageio_ffmpeg is None:
+            raise RuntimeError("Для --format mkv нужен пакет imageio-ffmpeg (pip install imageio-ffmpeg)")
 
         self.rec_dir = os.path.join(self.dataset_root, self.rec_id)
         self.frames_dir = os.path.join(self.rec_dir, "frames")
         self.csv_path = os.path.join(self.rec_dir, "events.csv")
         self.meta_path = os.path.join(self.rec_dir, "meta.json")
         self.task_path = os.path.join(self.rec_dir, "task.txt")
+        self.video_path = os.path.join(self.rec_dir, VIDEO_FILE)
         self.stop_flag_path = os.path.join(self.rec_dir, ".stop")  # ← ФЛАГ ОСТАНОВКИ (файлом)
-        os.makedirs(self.frames_dir, exist_ok=True)
+        os.makedirs(self.frames_dir if self.frame_format == "png" else self.rec_dir, exist_ok=True)
+        # префиксы путей кадров считаем один раз, в цикле — только f-строка
+        self._frames_prefix = self.frames_dir + os.sep
+        self._rel_prefix = os.path.relpath(self.frames_dir, self.rec_dir) + os.sep
 
-        self.events_q = SafeDeque()
+        self.events_q = EventQueue()
         self._start_perf: Optional[float] = None
+        # горячий путь слушателей: заранее связанные часы, t0 и append очереди
+        self._now = time.perf_counter
+        self._t0 = 0.0
+        self._append_event = self.events_q.append
         self._stop_flag = threading.Event()
         self._dev_last_report = 0.0
+        self._last_stopcheck = 0.0
         self._frames_captured = 0
         self._events_written = 0
         self._last_recorded_mouse_pos: Optional[Tuple[int, int]] = None
-        self._pressed_mods = set()
+        self._last_raw_xy: Tuple[int, int] = (-1, -1)  # последняя позиция из _ms_on_move
+        self._pressed_mods = ModifierSet()
+
+        # mkv: кадры должны попасть в поток по порядку, поэтому воркер один
+        workers = PNG_WORKERS if self.frame_format == "png" else 1
+        self._frame_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="frames")
+        self._frame_slots = threading.BoundedSemaphore(PNG_MAX_PENDING)
+        self._video = None  # генератор imageio_ffmpeg.write_frames, открывается на первом кадре
 
         self._stop_key_obj = self._parse_stop_key(self.stop_key_name)
+        self._monitor: Optional[Dict] = None
 
     # ---------- utils ----------
     def _now_rel(self) -> float:
         return time.perf_counter() - (self._start_perf or 0.0)
 
+    def _resolve_monitor(self, sct) -> Dict:
+        try:
+            self._monitor = sct.monitors[self.monitor_index]
+        except Exception:
+            self._monitor = sct.monitors[1]
+        return self._monitor
+
     def _parse_stop_key(self, name: str):
         name = (name or "").strip().upper()
         base = {
@@ -123,59 +299,48 @@ class Recorder:
         return keyboard.Key.f10
 
     def _normalize_key(self, key) -> Tuple[str, Optional[int]]:
-        try:
-            if isinstance(key, keyboard.KeyCode):
-                return key.char if key.char is not None else str(key), key.vk
+        if isinstance(key, keyboard.KeyCode):
+            return key.char if key.char is not None else str(key), key.vk
+        if isinstance(key, keyboard.Key):
             return key.name, None
-        except Exception:
-            return str(key), None
-
-    def _collect_mods(self) -> str:
-        if not self._pressed_mods:
-            return ""
-        order = ["cmd", "ctrl", "alt", "shift"]
-        return "+".join([m for m in order if m in self._pressed_mods])
+        return str(key), None
 
     # ---------- listeners ----------
-    def _kb_on_press(self, key):
+    def _kb_event(self, key, down: bool):
         name, vk = self._normalize_key(key)
-        if name in {"shift", "shift_l", "shift_r"}:
-            self._pressed_mods.add("shift")
-        elif name in {"ctrl", "ctrl_l", "ctrl_r"}:
-            self._pressed_mods.add("ctrl")
-        elif name in {"alt", "alt_l", "alt_r", "option"}:
-            self._pressed_mods.add("alt")
-        elif name in {"cmd", "cmd_l", "cmd_r", "super"}:
-            self._pressed_mods.add("cmd")
-
-        self.events_q.append(Event(self._now_rel(), "key_down", {"key": name, "key_code": vk, "modifiers": self._collect_mods()}))
+        mod = MODIFIER_MAP.get(name)
+        if mod is not None:
+            if down:
+                self._pressed_mods.add(mod)
+            else:
+                self._pressed_mods.discard(mod)
+        self._append_event(Event(self._now() - self._t0, "key_down" if down else "key_up",
+                                 key=name, key_code=vk, modifiers=self._pressed_mods.mods_str))
+
+    def _kb_on_press(self, key):
+        self._kb_event(key, True)
         if key == self._stop_key_obj:
             self._stop_flag.set()
 
     def _kb_on_release(self, key):
-        name, vk = self._normalize_key(key)
-        if name in {"shift", "shift_l", "shift_r"}:
-            self._pressed_mods.discard("shift")
-        elif name in {"ctrl", "ctrl_l", "ctrl_r"}:
-            self._pressed_mods.discard("ctrl")
-        elif name in {"alt", "alt_l", "alt_r", "option"}:
-            self._pressed_mods.discard("alt")
-        elif name in {"cmd", "cmd_l", "cmd_r", "super"}:
-            self._pressed_mods.discard("cmd")
-        self.events_q.append(Event(self._now_rel(), "key_up", {"key": name, "key_code": vk, "modifiers": self._collect_mods()}))
+        self._kb_event(key, False)
 
     def _ms_on_move(self, x, y):
-        self.events_q.append(Event(self._now_rel(), "mouse_move", {"x": int(x), "y": int(y)}))
+        # субпиксельные движения после int() часто дают ту же точку — такие не пишем
+        xi = int(x); yi = int(y)
+        if (xi, yi) == self._last_raw_xy:
+            return
+        self._last_raw_xy = (xi, yi)
+        self._append_event(Event(self._now() - self._t0, "mouse_move", xi, yi))
 
     def _ms_on_click(self, x, y, button, pressed):
-        self.events_q.append(Event(self._now_rel(), "mouse_click", {
-            "x": int(x), "y": int(y),
-            "button": getattr(button, "name", str(button)),
-            "action": "down" if pressed else "up",
-        }))
+        self._append_event(Event(self._now() - self._t0, "mouse_click", int(x), int(y),
+                                 button=getattr(button, "name", str(button)),
+                                 action="down" if pressed else "up"))
 
     def _ms_on_scroll(self, x, y, dx, dy):
-        self.events_q.append(Event(self._now_rel(), "mouse_scroll", {"x": int(x), "y": int(y), "scroll_dx": int(dx), "scroll_dy": int(dy)}))
+        self._append_event(Event(self._now() - self._t0, "mouse_scroll", int(x), int(y),
+                                 scroll_dx=int(dx), scroll_dy=int(dy)))
 
     # ---------- io ----------
     def _write_meta(self, monitor: Dict):
@@ -188,6 +353,9 @@ class Recorder:
             "notes": "Все события между кадрами i и i+1 приписаны к кадру i.",
             "stop_key": self.stop_key_name,
             "operator": self.operator,
+            "coalesce_moves": self.coalesce_moves,
+            "frame_format": self.frame_format,
+            "capture_size": list(self.capture_size) if self.capture_size else None,
         }
         with open(self.meta_path, "w", encoding="utf-8") as f:
             json.dump(meta, f, ensure_ascii=False, indent=2)
@@ -197,14 +365,67 @@ class Recorder:
             f.write((self.task_text or "(задача не указана)").strip() + "\n")
 
     def _open_csv(self):
-        fieldnames = [
-            "row_type", "frame_id", "time_s", "event_type", "frame_path",
-            "x", "y", "dx", "dy", "key", "key_code", "mouse_button", "action", "scroll_dx", "scroll_dy", "modifiers",
-        ]
-        f = open(self.csv_path, "w", newline="", encoding="utf-8")
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        return f, writer
+        # строки собираем сами (см. _event_row/_frame_row) и пишем байтами одним write на тик
+        f = open(self.csv_path, "wb", buffering=CSV_BUFFER_SIZE)
+        f.write(CSV_HEADER.encode("utf-8"))
+        return f
+
+    def _event_row(self, ev: Event, frame_id: int) -> str:
+        # порядок колонок — CSV_FIELDS; экранировать может понадобиться только key/кнопку
+        t = round(ev.ts, 6)
+        if ev.etype.startswith("mouse"):
+            x, y = ev.x, ev.y
+            last = self._last_recorded_mouse_pos
+            if last is None:
+                dx = dy = 0
+            else:
+                dx = x - last[0]
+                dy = y - last[1]
+            self._last_recorded_mouse_pos = (x, y)
+            if ev.etype == "mouse_move":
+                return f"event,{frame_id},{t},mouse_move,,{x},{y},{dx},{dy},,,,,,,\r\n"
+            return (f"event,{frame_id},{t},{ev.etype},,{x},{y},{dx},{dy},,,"
+                    f"{_csv_field(ev.button)},{_csv_field(ev.action)},"
+                    f"{_csv_field(ev.scroll_dx)},{_csv_field(ev.scroll_dy)},\r\n")
+        return (f"event,{frame_id},{t},{ev.etype},,,,,,"
+                f"{_csv_field(ev.key)},{_csv_field(ev.key_code)},,,,,{_csv_field(ev.modifiers)}\r\n")
+
+    def _frame_row(self, frame_id: int, t_rel: float) -> str:
+        if self.frame_format == "png":
+            ref = f"{self._rel_prefix}{frame_id:06d}.png"
+        else:
+            ref = f"{VIDEO_FILE}#{frame_id}"
+        return f"frame,{frame_id},{round(t_rel, 6)},frame,{ref}{_FRAME_ROW_PAD}\r\n"
+
+    def _submit_frame(self, img, frame_id: int):
+        # img.raw — свежий bytearray на каждый grab (mss его не переиспользует), поэтому
+        # отдаём его воркеру как есть: img.bgra сделал бы ещё одну полную копию кадра
+        self._frame_slots.acquire()
+        if self.frame_format == "png":
+            fut = self._frame_pool.submit(_encode_and_write, img.raw, img.size,
+                                          f"{self._frames_prefix}{frame_id:06d}.png", self.capture_size)
+        else:
+            fut = self._frame_pool.submit(self._write_video_frame, img.raw, img.size)
+        fut.add_done_callback(self._on_frame_written)
+
+    def _write_video_frame(self, bgra: bytearray, size: Tuple[int, int]):
+        if self._video is None:
+            # ffmpeg сам конвертирует BGRA → yuv420p (и уменьшает кадр), libx264 кодирует в своих потоках
+            output_params = None
+            if self.capture_size is not None:
+                output_params = ["-vf", f"scale={self.capture_size[0]}:{self.capture_size[1]}:flags=area"]
+            self._video = imageio_ffmpeg.write_frames(
+                self.video_path, size, fps=self.fps, codec="libx264", quality=8,
+                pix_fmt_in="bgra", macro_block_size=2, output_params=output_params,
+            )
+            self._video.send(None)
+        self._video.send(bgra)
+
+    def _on_frame_written(self, fut: Future):
+        self._frame_slots.release()
+        exc = fut.exception()
+        if exc is not None:
+            print(f"[ERR] Не удалось сохранить кадр: {exc}")
 
     def _dev_report(self, now_rel: float):
         if not self.dev:
@@ -228,128 +449,93 @@ class Recorder:
         kb_listener.start()
         ms_listener.start()
 
-        with mss() as sct:
-            try:
-                monitor = sct.monitors[self.monitor_index]
-            except Exception:
-                monitor = sct.monitors[1]
+        sct = get_sct()
+        monitor = self._monitor or self._resolve_monitor(sct)
 
-            self._write_meta(monitor)
-            self._write_task()
-            csv_file, writer = self._open_csv()
-            try:
-                self._start_perf = time.perf_counter()
-                next_capture = self._start_perf
-                frame_id = 0
-                self._last_recorded_mouse_pos = None
-
-                # Первый кадр
-                img = sct.grab(monitor)
-                im = Image.frombytes("RGB", img.size, img.rgb)
-                frame_id = 1
-                frame_path = os.path.join(self.frames_dir, f"{frame_id:06d}.png")
-                im.save(frame_path, format="PNG", optimize=False, compress_level=1)
-                t_rel = self._now_rel()
-                writer.writerow({
-                    "row_type": "frame", "frame_id": frame_id, "time_s": round(t_rel, 6),
-                    "event_type": "frame", "frame_path": os.path.relpath(frame_path, self.rec_dir),
-                })
-                csv_file.flush()
-                self._frames_captured += 1
-                next_capture = self._start_perf + self.dt
-
-                # Цикл
-                while not self._stop_flag.is_set():
-                    # аварийный стоп-файл
+        self._write_meta(monitor)
+        self._write_task()
+        csv_file = self._open_csv()
+        try:
+            self._start_perf = time.perf_counter()
+            self._t0 = self._start_perf
+            next_capture = self._start_perf
+            frame_id = 0
+            self._last_recorded_mouse_pos = None
+
+            # Первый кадр
+            img = sct.grab(monitor)
+            frame_id = 1
+            self._submit_frame(img, frame_id)
+            t_rel = self._now_rel()
+            csv_file.write(self._frame_row(frame_id, t_rel).encode("utf-8"))
+            csv_file.flush()
+            last_flush = time.perf_counter()
+            self._frames_captured += 1
+            next_capture = self._start_perf + self.dt
+
+            # строки одного тика копим и пишем одним write
+            pending_rows: list[str] = []
+
+            # Цикл
+            while not self._stop_flag.is_set():
+                # аварийный стоп-файл
+                now_rel = self._now_rel()
+                if now_rel - self._last_stopcheck >= STOP_FILE_CHECK_INTERVAL_S:
+                    self._last_stopcheck = now_rel
                     if os.path.exists(self.stop_flag_path):
                         self._stop_flag.set()
                         break
 
-                    while True:
-                        now_abs = time.perf_counter()
-                        remaining = next_capture - now_abs
-                        if remaining <= 0:
-                            break
-                        time.sleep(min(remaining, 0.005))
-
-                    img = sct.grab(monitor)
-                    t_boundary_rel = self._now_rel()
-                    im = Image.frombytes("RGB", img.size, img.rgb)
-                    next_frame_id = frame_id + 1
-
-                    for ev in self.events_q.pop_all_upto(t_boundary_rel):
-                        row = {
-                            "row_type": "event", "frame_id": frame_id,
-                            "time_s": round(ev.ts, 6), "event_type": ev.etype,
-                        }
-                        if ev.etype.startswith("mouse"):
-                            x = int(ev.payload.get("x", -1))
-                            y = int(ev.payload.get("y", -1))
-                            if self._last_recorded_mouse_pos is None:
-                                dx = dy = 0
-                            else:
-                                dx = x - self._last_recorded_mouse_pos[0]
-                                dy = y - self._last_recorded_mouse_pos[1]
-                            self._last_recorded_mouse_pos = (x, y)
-                            row.update({"x": x, "y": y, "dx": dx, "dy": dy,
-                                        "mouse_button": ev.payload.get("button"),
-                                        "action": ev.payload.get("action"),
-                                        "scroll_dx": ev.payload.get("scroll_dx"),
-                                        "scroll_dy": ev.payload.get("scroll_dy")})
-                        elif ev.etype.startswith("key"):
-                            row.update({"key": ev.payload.get("key"),
-                                        "key_code": ev.payload.get("key_code"),
-                                        "modifiers": ev.payload.get("modifiers")})
-                        writer.writerow(row)
-                        csv_file.flush()
-                        self._events_written += 1
-
-                    frame_path = os.path.join(self.frames_dir, f"{next_frame_id:06d}.png")
-                    im.save(frame_path, format="PNG", optimize=False, compress_level=1)
-                    writer.writerow({
-                        "row_type": "frame", "frame_id": next_frame_id,
-                        "time_s": round(t_boundary_rel, 6), "event_type": "frame",
-                        "frame_path": os.path.relpath(frame_path, self.rec_dir),
-                    })
-                    csv_file.flush()
-                    self._frames_captured += 1
-
-                    frame_id = next_frame_id
-                    next_capture += self.dt
-                    self._dev_report(self._now_rel())
-
-                    if self.max_duration is not None and self._now_rel() >= self.max_duration:
-                        self._stop_flag.set()
+                now_abs = time.perf_counter()
+                remaining = next_capture - now_abs
+                if remaining > 0:
+                    # спим ровно до следующего кадра; стоп будит ожидание сразу
+                    if self._stop_flag.wait(remaining):
+                        break
+                    now_abs = time.perf_counter()
 
-                # добираем «хвост» событий
-                for ev in self.events_q.drain_all():
-                    row = {
-                        "row_type": "event", "frame_id": frame_id,
-                        "time_s": round(ev.ts, 6), "event_type": ev.etype,
-                    }
-                    if ev.etype.startswith("mouse"):
-                        x = int(ev.payload.get("x", -1))
-                        y = int(ev.payload.get("y", -1))
-                        if self._last_recorded_mouse_pos is None:
-                            dx = dy = 0
-                        else:
-                            dx = x - self._last_recorded_mouse_pos[0]
-                            dy = y - self._last_recorded_mouse_pos[1]
-                        self._last_recorded_mouse_pos = (x, y)
-                        row.update({"x": x, "y": y, "dx": dx, "dy": dy,
-                                    "mouse_button": ev.payload.get("button"),
-                                    "action": ev.payload.get("action"),
-                                    "scroll_dx": ev.payload.get("scroll_dx"),
-                                    "scroll_dy": ev.payload.get("scroll_dy")})
-                    elif ev.etype.startswith("key"):
-                        row.update({"key": ev.payload.get("key"),
-                                    "key_code": ev.payload.get("key_code"),
-                                    "modifiers": ev.payload.get("modifiers")})
-                    writer.writerow(row)
+                img = sct.grab(monitor)
+                t_boundary_rel = self._now_rel()
+                next_frame_id = frame_id + 1
+
+                events = self.events_q.pop_all_upto(t_boundary_rel)
+                if self.coalesce_moves:
+                    events = coalesce_mouse_moves(events)
+                for ev in events:
+                    pending_rows.append(self._event_row(ev, frame_id))
+                self._events_written += len(pending_rows)
+
+                self._submit_frame(img, next_frame_id)
+                pending_rows.append(self._frame_row(next_frame_id, t_boundary_rel))
+                csv_file.write("".join(pending_rows).encode("utf-8"))
+                pending_rows.clear()
+                if now_abs - last_flush >= CSV_FLUSH_INTERVAL_S:
                     csv_file.flush()
-                    self._events_written += 1
-            finally:
-                csv_file.close()
+                    last_flush = now_abs
+                self._frames_captured += 1
+
+                frame_id = next_frame_id
+                next_capture += self.dt
+                self._dev_report(self._now_rel())
+
+                if self.max_duration is not None and self._now_rel() >= self.max_duration:
+                    self._stop_flag.set()
+
+            # добираем «хвост» событий
+            events = self.events_q.drain_all()
+            if self.coalesce_moves:
+                events = coalesce_mouse_moves(events)
+            tail = [self._event_row(ev, frame_id) for ev in events]
+            csv_file.write("".join(tail).encode("utf-8"))
+            self._events_written += len(tail)
+            csv_file.flush()
+        finally:
+            # дожидаемся кодирования всех кадров до закрытия CSV
+            self._frame_pool.shutdown(wait=True)
+            if self._video is not None:
+                self._video.close()
+            csv_file.close()
+            close_sct()
 
         kb_listener.stop()
         ms_listener.stop()
@@ -374,6 +560,12 @@ def parse_args():
     p.add_argument("--dev", action="store_true")
     p.add_argument("--max-duration", type=float, default=None)
     p.add_argument("--operator", type=str, default="", help="Имя сборщика (запишется в meta.json)")
+    p.add_argument("--format", dest="frame_format", choices=FRAME_FORMATS, default="png",
+                   help="png — отдельный файл на кадр; mkv — все кадры в frames.mkv (нужен imageio-ffmpeg)")
+    p.add_argument("--capture-size", type=parse_size, default=None,
+                   help="Уменьшать кадры до WxH перед кодированием, например 1280x720 (по умолчанию — родное разрешение)")
+    p.add_argument("--coalesce-moves", action="store_true",
+                   help="Оставлять один mouse_move на серию движений между кадрами (без флага пишется сырой трек)")
     return p.parse_args()
 
 
@@ -389,6 +581,9 @@ def main():
         dev=args.dev,
         max_duration=args.max_duration,
         operator=args.operator,
+        coalesce_moves=args.coalesce_moves,
+        frame_format=args.frame_format,
+        capture_size=args.capture_size,
     )
 
     def _graceful_stop(signum, frame):
@@ -1,42 +1,70 @@
+import asyncio
 import os
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from collections import deque
 
 
 client = OpenAI(api_key=os.environ.get('DEEPSEEK_API_KEY'), base_url="https://api.deepseek.com")
+aclient = AsyncOpenAI(api_key=os.environ.get('DEEPSEEK_API_KEY'), base_url="https://api.deepseek.com")
+
+SYSTEM_PROMPT = ("Create new task for computer agent dataset. Example of output:"
+                 "Task: 'task name'"
+                 "Steps:\\n"
+                 "Send mail to Bob:\\n"
+                 "1. Open Google Chrome\\n"
+                 "2. Go to mail.google.com and etc."
+                 "Expected outcome: 'expected outcome'"
+                 "Note: we are teaching agents to replace routine work from office clerks."
+                 "So create suitable tasks."
+                 "Apps You can use:"
+                 "Windows system: explorer, settings, etc;"
+                 "Google Chrome (websites, shops,"
+                 "mail, etc), Excel, Word, Notepad, Calc, Desktop"
+                 "Initial env is empty Desktop with only mentioned apps."
+                 "So don't create tasks with files that doesn't exist."
+                 "Use chains of tasks: if first task opens a window, next one should "
+                 "either close it or do something new in it, but dont forget to make"
+                 "them different."
+                 "Lets start with easy tasks to let him get the base moves"
+                 "(desktop, folders, apps open/close, mail, browser, etc)")
+
 
 class TaskWriter:
     def __init__(self, show_n_last_tasks=5):
         self.prev_n_tasks = deque(maxlen=show_n_last_tasks)
+        self._user_msg = self._build_user_msg()
+
+    def _build_user_msg(self):
+        return (f"Last created tasks: {self.prev_n_tasks}"
+                "Create new task")
+
+    def _messages(self):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": self._user_msg},
+        ]
+
+    def _remember(self, task):
+        self.prev_n_tasks.append(task)
+        self._user_msg = self._build_user_msg()  # пересобираем только когда история меняется
+        return task
 
     def new_task(self):
         response = client.chat.completions.create(
             model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "Create new task for computer agent dataset. Example of output:"
-                                              "Task: 'task name'"
-                                              "Steps:\\n"
-                                              "Send mail to Bob:\\n"
-                                              "1. Open Google Chrome\\n"
-                                              "2. Go to mail.google.com and etc."
-                                              "Expected outcome: 'expected outcome'"
-                                              "Note: we are teaching agents to replace routine work from office clerks."
-                                              "So create suitable tasks."
-                                              "Apps You can use:"
-                                              "Windows system: explorer, settings, etc;"
-                                              "Google Chrome (websites, shops,"
-                                              "mail, etc), Excel, Word, Notepad, Calc, Desktop"
-                                              "Initial env is empty Desktop with only mentioned apps."
-                                              "So don't create tasks with files that doesn't exist."
-                                              "Use chains of tasks: if first task opens a window, next one should "
-                                              "either close it or do something new in it, but dont forget to make"
-                                              "them different."
-                                              "Lets start with easy tasks to let him get the base moves"
-                                              "(desktop, folders, apps open/close, mail, browser, etc)"},
-                {"role": "user", "content": f"Last created tasks: {self.prev_n_tasks}"
-                                            "Create new task"}
-            ],
+            messages=self._messages(),
             stream=False
         )
-        self.prev_n_tasks.append(response.choices[0].message.content)
-        return response.choices[0].message.content
+        return self._remember(response.choices[0].message.content)
+
+    async def new_task_async(self):
+        response = await aclient.chat.completions.create(
+            model="deepseek-chat",
+            messages=self._messages(),
+            stream=False
+        )
+        return self._remember(response.choices[0].message.content)
+
+    async def generate_n(self, n):
+        # запросы идут параллельно и видят одну и ту же историю задач
+        return list(await asyncio.gather(*(self.new_task_async() for _ in range(n))))
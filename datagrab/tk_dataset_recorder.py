@@ -17,20 +17,35 @@ ENV (опционально):
 """
 from __future__ import annotations
 
-import json, os, platform, signal, subprocess, sys, threading, time, shutil
+import json, os, platform, signal, stat, subprocess, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, Dict, Any, List
 
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
+from tkinter import ttk
+# messagebox/filedialog, shutil, zipfile импортируем лениво в обработчиках: под PyInstaller
+# каждый модуль при старте распаковывается из архива, а нужны они только по действию пользователя
 
 from llm_task_writer import TaskWriter
 
 
 WRITER = TaskWriter()
 
+# при экспорте сжимаем только текст; кадры (PNG/видео) уже сжаты — их кладём как есть (ZIP_STORED)
+ZIP_DEFLATE_EXTS = {".csv", ".json", ".txt"}
+
+# стили кнопок: (имя, configure, map) — константы, собираются один раз при импорте
+_BTN_FONT = ("SF Pro Text", 12, "bold")
+_STYLES = (
+    ("Start.TButton", dict(background="#22c55e", foreground="white", padding=8, font=_BTN_FONT),
+     dict(background=[("active","#16a34a"),("disabled","#86efac")])),
+    ("Stop.TButton", dict(background="#ef4444", foreground="white", padding=8, font=_BTN_FONT),
+     dict(background=[("active","#dc2626"),("disabled","#fca5a5")])),
+)
+
 # -------- задачи --------
 @dataclass
 class Task:
@@ -61,8 +76,11 @@ class App(tk.Tk):
         self.current_task: Optional[Task] = None
         self.rec_proc: Optional[subprocess.Popen] = None
         self.recording = False
-        self.rec_start_time: Optional[float] = None
+        self.rec_start_ns: Optional[int] = None  # time.monotonic_ns() на старте записи
         self._timer_job = None
+        self._start_job = None  # отложенный запуск рекордера (после сворачивания окна)
+        self._stopping = False  # остановка уже идёт: повторный on_finish ничего не делает
+        self._recorder_path: Optional[Path] = None  # кэш _find_recorder_binary
 
         self.dataset_root_dir = Path(os.environ.get("DATASET_ROOT", "./dataset")).resolve()
         self.operator = self._detect_operator()
@@ -76,7 +94,11 @@ class App(tk.Tk):
         self._build_ui()
         self._bind_hotkeys()
 
-        self._size_thread_running = False; self._size_job = None
+        self._size_job = None; self._closing = False
+        self._size_cache: Dict[str, tuple[int, int]] = {}  # путь rec_* → (st_mtime_ns, размер)
+        # один долгоживущий поток считает размер по сигналу вместо нового Thread на каждый тик
+        self._size_evt = threading.Event()
+        threading.Thread(target=self._size_worker, daemon=True).start()
         self._schedule_size_tick()
 
         self._fetch_and_show_next_task()
@@ -87,12 +109,8 @@ class App(tk.Tk):
         self.style = ttk.Style(self)
         try: self.style.theme_use("clam")
         except Exception: pass
-        self.style.configure("Start.TButton", background="#22c55e", foreground="white",
-                             padding=8, font=("SF Pro Text", 12, "bold"))
-        self.style.map("Start.TButton", background=[("active","#16a34a"),("disabled","#86efac")])
-        self.style.configure("Stop.TButton", background="#ef4444", foreground="white",
-                             padding=8, font=("SF Pro Text", 12, "bold"))
-        self.style.map("Stop.TButton", background=[("active","#dc2626"),("disabled","#fca5a5")])
+        for name, conf, state_map in _STYLES:
+            self.style.configure(name, **conf); self.style.map(name, **state_map)
 
     # ---- UI ----
     def _build_ui(self):
@@ -167,7 +185,8 @@ class App(tk.Tk):
 
     # ---- старт ----
     def on_start(self):
-        if self.rec_proc is not None or not self.current_task: return
+        if self.rec_proc is not None or self._start_job is not None or not self.current_task: return
+        from tkinter import messagebox
 
         rec_bin = self._find_recorder_binary()
         if not rec_bin:
@@ -194,20 +213,31 @@ class App(tk.Tk):
             print("[INFO] macOS: если запись не стартует, дайте права в Privacy & Security → "
                   "Screen Recording / Input Monitoring / Accessibility")
 
+        # пауза после сворачивания — через after(), а не sleep: цикл событий Tk не замирает
+        delay_ms = 0
         if self.auto_minimize:
-            try: self.iconify(); self.update_idletasks(); time.sleep(self.start_delay_ms/1000.0)
+            try: self.iconify(); delay_ms = self.start_delay_ms
             except Exception: pass
+        self.btn_start.state(["disabled"])
+        self._start_job = self.after(delay_ms, self._do_spawn_recorder, cmd, rec_id, rec_dir)
 
+    def _do_spawn_recorder(self, cmd: List[str], rec_id: str, rec_dir: Path):
+        from tkinter import messagebox
+        self._start_job = None
         try:
-            self.rec_proc = subprocess.Popen(cmd, start_new_session=True)
+            # Свои fd Python и так создаёт ненаследуемыми (PEP 446), поэтому на POSIX close_fds=False
+            # безопасен и избавляет fork_exec от перебора всех дескрипторов перед exec.
+            # start_new_session оставляем: на него опирается killpg в on_finish.
+            self.rec_proc = subprocess.Popen(cmd, start_new_session=True, close_fds=(os.name == "nt"))
         except Exception as e:
             try: self.deiconify(); self.lift(); self.focus_force()
             except Exception: pass
+            if self.current_task: self.btn_start.state(["!disabled"])
             messagebox.showerror("Не удалось запустить запись", str(e)); return
 
         self.recording = True
         self._current_rec = {"rec_id": rec_id, "rec_dir": str(rec_dir)}
-        self.rec_start_time = time.time(); self._tick_timer()
+        self.rec_start_ns = time.monotonic_ns(); self._tick_timer()
         self.btn_start.state(["disabled"]); self.btn_finish.state(["!disabled"])
         self.btn_finish.focus_set()
         self.status_var.set(f"Запись идёт → {rec_id}")
@@ -220,8 +250,13 @@ class App(tk.Tk):
 
     # ---- стоп ----
     def on_finish(self):
-        if self.rec_proc is None:
+        proc = self.rec_proc
+        if proc is None:
             self.status_var.set("Нет активной записи"); return
+        if self._stopping: return
+        # один stopper на запись: повторные клики / Cmd+. не шлют сигналы по второму кругу
+        self._stopping = True
+        self.btn_finish.state(["disabled"])
 
         self.status_var.set("Завершаю запись…")
 
@@ -233,34 +268,32 @@ class App(tk.Tk):
 
         # сигналы в группу
         try:
-            import os; pgid = os.getpgid(self.rec_proc.pid)
+            pgid = os.getpgid(proc.pid)
         except Exception:
             pgid = None
 
         def kill_group(sig):
             try:
                 if pgid is not None: os.killpg(pgid, sig)
-                else: self.rec_proc.send_signal(sig)
+                else: proc.send_signal(sig)
             except Exception: pass
 
-        try:
-            if self.rec_proc.poll() is None:
-                kill_group(signal.SIGINT)
-                for _ in range(30):
-                    if self.rec_proc.poll() is not None: break
-                    time.sleep(0.1)
-            if self.rec_proc.poll() is None:
-                kill_group(signal.SIGTERM)
-                for _ in range(30):
-                    if self.rec_proc.poll() is not None: break
-                    time.sleep(0.1)
-            if self.rec_proc.poll() is None:
+        # ждём в фоне через wait(timeout), UI не блокируется; кнопки вернёт watcher → _on_recorder_stopped
+        def stopper():
+            try:
+                for sig in (signal.SIGINT, signal.SIGTERM):
+                    if proc.poll() is not None: return
+                    kill_group(sig)
+                    try: proc.wait(timeout=3.0); return
+                    except subprocess.TimeoutExpired: pass
                 kill_group(signal.SIGKILL)
-        except Exception:
-            pass
+            except Exception:
+                pass
+        threading.Thread(target=stopper, daemon=True).start()
 
     # ---- экспорт/очистка ----
     def _export_zip(self):
+        from tkinter import filedialog, messagebox
         default_name = f"dataset_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
         save_path = filedialog.asksaveasfilename(
             title="Экспорт датасета в ZIP", defaultextension=".zip",
@@ -270,9 +303,7 @@ class App(tk.Tk):
         def worker():
             try:
                 self._set_dataset_actions_enabled(False); self.status_var.set("Экспортирую в ZIP…")
-                base = Path(save_path); base_no_ext = str(base.with_suffix(""))
-                shutil.make_archive(base_no_ext, "zip",
-                    root_dir=str(self.dataset_root_dir.parent), base_dir=self.dataset_root_dir.name)
+                self._write_dataset_zip(save_path)
                 self.after(0, lambda: messagebox.showinfo("Готово", f"Экспортировано:\n{save_path}"))
             except Exception as e:
                 self.after(0, lambda: messagebox.showerror("Ошибка экспорта", str(e)))
@@ -280,7 +311,27 @@ class App(tk.Tk):
                 self.after(0, lambda: (self._set_dataset_actions_enabled(True), self.status_var.set("Готово")))
         threading.Thread(target=worker, daemon=True).start()
 
+    def _write_dataset_zip(self, save_path: str):
+        import zipfile
+        # та же раскладка, что у make_archive: <имя папки датасета>/rec_*/...
+        out = os.path.abspath(save_path)
+        with zipfile.ZipFile(save_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+            stack = [(str(self.dataset_root_dir), self.dataset_root_dir.name)]
+            while stack:
+                d, arc = stack.pop()
+                zf.write(d, arc)  # запись каталога
+                with os.scandir(d) as it:
+                    for entry in it:
+                        name = f"{arc}/{entry.name}"
+                        if entry.is_dir(follow_symlinks=False): stack.append((entry.path, name))
+                        elif entry.is_file(follow_symlinks=False) and os.path.abspath(entry.path) != out:
+                            if os.path.splitext(entry.name)[1].lower() in ZIP_DEFLATE_EXTS:
+                                zf.write(entry.path, name, compress_type=zipfile.ZIP_DEFLATED)
+                            else:
+                                zf.write(entry.path, name)
+
     def _clear_dataset(self):
+        from tkinter import messagebox
         if self.rec_proc is not None and self.rec_proc.poll() is None:
             messagebox.showwarning("Идёт запись", "Нельзя очищать датасет во время записи."); return
         if not self.dataset_root_dir.exists():
@@ -292,11 +343,9 @@ class App(tk.Tk):
         def worker():
             try:
                 self._set_dataset_actions_enabled(False); self.status_var.set("Очищаю датасет…")
-                for entry in self.dataset_root_dir.iterdir():
-                    try:
-                        if entry.is_dir(): shutil.rmtree(entry)
-                        else: entry.unlink()
-                    except Exception: pass
+                # удаление — чистый I/O: rec_* сносим параллельно, unlink/rmdir из разных потоков перекрываются
+                with ThreadPoolExecutor(max_workers=8) as pool:
+                    list(pool.map(self._remove_entry, self.dataset_root_dir.iterdir()))
                 self.after(0, lambda: messagebox.showinfo("Готово", "Датасет очищен."))
             except Exception as e:
                 self.after(0, lambda: messagebox.showerror("Ошибка очистки", str(e)))
@@ -304,36 +353,73 @@ class App(tk.Tk):
                 self.after(0, lambda: (self._set_dataset_actions_enabled(True), self.status_var.set("Готово")))
         threading.Thread(target=worker, daemon=True).start()
 
+    @staticmethod
+    def _remove_entry(entry: Path):
+        import shutil
+        try:
+            if entry.is_dir(): shutil.rmtree(entry, ignore_errors=True)
+            else: entry.unlink(missing_ok=True)
+        except Exception: pass
+
     def _set_dataset_actions_enabled(self, enabled: bool):
         self.btn_start.state(["!disabled"] if (enabled and self.current_task and self.rec_proc is None) else ["disabled"])
-        self.btn_finish.state(["!disabled"] if (enabled and self.rec_proc is not None) else ["disabled"])
+        self.btn_finish.state(["!disabled"] if (enabled and self.rec_proc is not None and not self._stopping)
+                              else ["disabled"])
 
     # ---- размер датасета ----
     def _schedule_size_tick(self): self._size_job = self.after(2000, self._size_tick)
     def _size_tick(self):
-        if self._size_thread_running: return self._schedule_size_tick()
-        def worker():
-            self._size_thread_running = True
+        self._size_evt.set(); self._schedule_size_tick()  # если воркер ещё считает — тики схлопнутся
+    def _size_worker(self):
+        while True:
+            self._size_evt.wait(); self._size_evt.clear()
+            if self._closing: return
             try:
-                size = self._dir_size_bytes(self.dataset_root_dir)
+                size = self._dataset_size_bytes()
                 self.after(0, lambda: self.dataset_size_var.set(f"Размер: {self._format_size(size)}"))
-            finally:
-                self._size_thread_running = False; self._schedule_size_tick()
-        threading.Thread(target=worker, daemon=True).start()
+            except Exception: pass
+    def _dataset_size_bytes(self) -> int:
+        # Законченные rec_* не меняются: их размер берём из кэша, пока не сдвинулся mtime папки.
+        # Идущую запись пересчитываем всегда — новые кадры mtime самой rec_* не трогают.
+        root = self.dataset_root_dir
+        if not root.exists(): return 0
+        active = self._current_rec.get("rec_dir") if (self.rec_proc is not None and hasattr(self, "_current_rec")) else None
+        total = 0; seen = set()
+        try:
+            with os.scandir(root) as it:
+                for entry in it:
+                    try: st = entry.stat(follow_symlinks=False)
+                    except Exception: continue
+                    if stat.S_ISLNK(st.st_mode): continue
+                    if not stat.S_ISDIR(st.st_mode):
+                        total += st.st_size; continue
+                    seen.add(entry.path)
+                    cached = self._size_cache.get(entry.path)
+                    if entry.path != active and cached is not None and cached[0] == st.st_mtime_ns:
+                        total += cached[1]; continue
+                    size = self._dir_size_bytes(entry.path)
+                    if entry.path != active: self._size_cache[entry.path] = (st.st_mtime_ns, size)
+                    total += size
+        except Exception:
+            return 0
+        for gone in [p for p in self._size_cache if p not in seen]:
+            del self._size_cache[gone]
+        return total
     @staticmethod
-    def _dir_size_bytes(path: Path) -> int:
-        if not path.exists(): return 0
-        total = 0; stack = [path]
+    def _dir_size_bytes(path: str | os.PathLike) -> int:
+        # в стеке сырые str-пути: os.scandir их принимает, Path на каждый каталог не строим
+        total = 0; stack = [os.fspath(path)]
         while stack:
             p = stack.pop()
             try:
                 with os.scandir(p) as it:
                     for entry in it:
+                        # тип берём из d_type, закэшированного readdir (без syscall);
+                        # stat только ради размера обычного файла, симлинки не считаем
                         try:
-                            if entry.is_symlink(): continue
-                            if entry.is_dir(follow_symlinks=False): stack.append(Path(entry.path))
-                            else: total += entry.stat(follow_symlinks=False).st_size
-                        except Exception: continue
+                            if entry.is_dir(follow_symlinks=False): stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False): total += entry.stat(follow_symlinks=False).st_size
+                        except OSError: continue
             except Exception: continue
         return total
     @staticmethod
@@ -344,6 +430,7 @@ class App(tk.Tk):
 
     # ---- завершение ----
     def _on_recorder_stopped(self, returncode: Optional[int], rec_id: str):
+        from tkinter import messagebox
         try:
             self.deiconify();
             self.lift();
@@ -378,12 +465,19 @@ class App(tk.Tk):
         except Exception:
             pass
 
-        self.rec_proc = None
+        self.rec_proc = None; self._stopping = False
         self.status_var.set("Готово")
         self._fetch_and_show_next_task()  # _apply_task сам включит кнопку "Начать запись"
 
     # ---- поиск рекордера ----
     def _find_recorder_binary(self) -> Optional[Path]:
+        # найденный путь запоминаем: пока файл на месте, кандидатов заново не перебираем
+        if self._recorder_path is not None and self._recorder_path.exists():
+            return self._recorder_path
+        self._recorder_path = self._locate_recorder_binary()
+        return self._recorder_path
+
+    def _locate_recorder_binary(self) -> Optional[Path]:
         # 0) явный путь из окружения
         env = os.environ.get("RECORDER_BIN", "").strip()
         if env:
@@ -396,15 +490,16 @@ class App(tk.Tk):
         else:
             base = Path(__file__).resolve().parent
 
-        # кандидаты: рядом с GUI
-        cands: List[Path] = [
-            base / "datagrabber_69.exe",
+        # кандидаты: рядом с GUI (.exe ищем только на Windows — в остальных ОС это заведомый ENOENT)
+        system = platform.system()
+        cands: tuple[Path, ...] = (
+            *((base / "datagrabber_69.exe",) if system == "Windows" else ()),
             base / "datagrabber_69",
-        ]
+        )
 
         # macOS .app — мы и так в Contents/MacOS, но на всякий
-        if platform.system() == "Darwin":
-            cands.insert(0, Path(sys.executable).resolve().parent / "datagrabber_69")
+        if system == "Darwin":
+            cands = (Path(sys.executable).resolve().parent / "datagrabber_69",) + cands
 
         for c in cands:
             if c.exists():
@@ -419,8 +514,9 @@ class App(tk.Tk):
 
     # ---- утилиты ----
     def _tick_timer(self):
-        if self.rec_start_time is None: return
-        dt = int(time.time() - self.rec_start_time); mm, ss = divmod(dt, 60)
+        if self.rec_start_ns is None: return
+        # монотонные часы: перевод системного времени/NTP не двигает таймер
+        dt = (time.monotonic_ns() - self.rec_start_ns) // 1_000_000_000; mm, ss = divmod(dt, 60)
         self.timer_var.set(f"{mm:02d}:{ss:02d}")
         self._timer_job = self.after(1000, self._tick_timer)
 
@@ -443,6 +539,10 @@ class App(tk.Tk):
                     self.rec_proc.send_signal(signal.SIGINT)
         except Exception: pass
         # cancel timers
+        if self._start_job is not None:
+            try: self.after_cancel(self._start_job)
+            except Exception: pass
+            self._start_job = None
         if self._timer_job is not None:
             try: self.after_cancel(self._timer_job)
             except Exception: pass
@@ -451,6 +551,7 @@ class App(tk.Tk):
             try: self.after_cancel(self._size_job)
             except Exception: pass
             self._size_job = None
+        self._closing = True; self._size_evt.set()
         self.destroy()
 
 
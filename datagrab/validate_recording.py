@@ -7,6 +7,7 @@ Validate Recording
 - события (event) привязаны к ПРЕДЫДУЩЕМУ кадру: frame_id=k ⇒ time_s(event) ≤ time_s(frame k+1)
 - для k>1 ожидаем time_s(event) ≥ time_s(frame k) (исключение: ранние события ДО первого кадра допускаются и будут помечены как предупреждение)
 - все пути к кадрам из CSV существуют; размеры всех кадров одинаковые
+  (для записей с --format mkv frame_path имеет вид frames.mkv#<frame_id>: проверяется только наличие файла)
 - валидируем целостность dx,dy для мыши: dx,dy == разница с предыдущей зафиксированной позицией (по CSV)
 - считаем статистику: события/кадр, частоты типов событий, средний интервал между кадрами vs meta.fps
 
@@ -14,7 +15,7 @@ Validate Recording
     python validate_recording.py --rec-dir ./dataset/rec_1 --check-images --sample-frames 0
 
 Зависимости:
-    pip install pillow
+    pip install pillow numpy
 (если не хотите проверять изображения — можно запускать без Pillow и без флага --check-images)
 """
 from __future__ import annotations
@@ -24,30 +25,37 @@ import csv
 import json
 import math
 import os
+import sys
 from collections import defaultdict, Counter
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
-try:
-    from PIL import Image  # type: ignore
-except Exception:  # Pillow optional
-    Image = None  # type: ignore
+import numpy as np
 
 
-@dataclass
-class FrameRow:
-    fid: int
-    t: float
-    path: str
+class Frames(NamedTuple):
+    """Кадры по колонкам (numpy-массивы), отсортированы по fid."""
+    fid: np.ndarray
+    t: np.ndarray
+    path: List[str]
 
 
-@dataclass
-class EventRow:
-    fid: int
-    t: float
-    etype: str
-    payload: dict
+class Events(NamedTuple):
+    """События по колонкам, отсортированы по (fid, t).
+
+    etype — индекс имени в etypes; x, y, dx, dy имеют смысл только там, где mouse_ok
+    (мышиное событие с заполненными координатами).
+    """
+    fid: np.ndarray
+    t: np.ndarray
+    etype: np.ndarray
+    etypes: List[str]
+    x: np.ndarray
+    y: np.ndarray
+    dx: np.ndarray
+    dy: np.ndarray
+    mouse_ok: np.ndarray
 
 
 def load_meta(meta_path: Path) -> dict:
@@ -57,174 +65,286 @@ def load_meta(meta_path: Path) -> dict:
         return json.load(f)
 
 
-def load_csv(csv_path: Path) -> Tuple[List[FrameRow], List[EventRow]]:
-    frames: List[FrameRow] = []
-    events: List[EventRow] = []
-    with csv_path.open("r", encoding="utf-8") as f:
-        rdr = csv.DictReader(f)
+def _take(col: list, order, dtype=None):
+    """Колонка в порядке order: numpy-массив нужного dtype или (без dtype) список."""
+    if dtype is None:
+        return [col[i] for i in order]
+    return np.asarray(col, dtype=dtype)[order]
+
+
+def _toi(s: str) -> Optional[int]:
+    """int(s) или None, если int() строку не разбирает; обычная десятичная запись — без try/except."""
+    if s.isdecimal():
+        return int(s)
+    if not s:
+        return None
+    try:  # "-3", "+3", " 3" — int() их принимает, как и раньше
+        return int(s)
+    except ValueError:
+        return None
+
+
+def load_csv(csv_path: Path) -> Tuple[Frames, Events]:
+    f_fid: List[int] = []; f_t: List[float] = []; f_path: List[str] = []
+    e_fid: List[int] = []; e_t: List[float] = []; e_type: List[int] = []
+    e_x: List[int] = []; e_y: List[int] = []; e_dx: List[int] = []; e_dy: List[int] = []
+    e_ok: List[bool] = []
+    etype_ids: Dict[str, int] = {}
+    toi = _toi
+    with csv_path.open("r", encoding="utf-8", newline="") as f:
+        rdr = csv.reader(f)
+        header = next(rdr, None) or []
+        # отсутствующая колонка указывает на пустую ячейку в конце дополненной строки
+        width = len(header)
+        pad = [""] * (width + 1)
+        idx = {name: i for i, name in enumerate(header)}
+        i_rt, i_fid, i_t, i_path, i_et, i_x, i_y, i_dx, i_dy = (idx.get(n, width) for n in
+            ("row_type", "frame_id", "time_s", "frame_path", "event_type", "x", "y", "dx", "dy"))
         for row in rdr:
-            rtype = row.get("row_type", "").strip()
-            fid = int(row.get("frame_id", 0) or 0)
-            t = float(row.get("time_s", 0.0) or 0.0)
+            if len(row) <= width:
+                row += pad[len(row):]
+            rtype = row[i_rt].strip()
+            fid = int(row[i_fid] or 0)
+            t = float(row[i_t] or 0.0)
             if rtype == "frame":
-                frames.append(FrameRow(fid=fid, t=t, path=row.get("frame_path", "")))
+                f_fid.append(fid); f_t.append(t); f_path.append(row[i_path])
             elif rtype == "event":
-                etype = row.get("event_type", "").strip()
-                payload = {
-                    "x": row.get("x"),
-                    "y": row.get("y"),
-                    "dx": row.get("dx"),
-                    "dy": row.get("dy"),
-                    "key": row.get("key"),
-                    "key_code": row.get("key_code"),
-                    "mouse_button": row.get("mouse_button"),
-                    "action": row.get("action"),
-                    "scroll_dx": row.get("scroll_dx"),
-                    "scroll_dy": row.get("scroll_dy"),
-                    "modifiers": row.get("modifiers"),
-                }
-                events.append(EventRow(fid=fid, t=t, etype=etype, payload=payload))
-    frames.sort(key=lambda r: r.fid)
-    events.sort(key=lambda r: (r.fid, r.t))
+                etype = row[i_et].strip()
+                k = etype_ids.get(etype)
+                if k is None:
+                    k = etype_ids[etype] = len(etype_ids)
+                x = y = dx = dy = 0
+                ok = False
+                if etype.startswith("mouse"):
+                    vals = (toi(row[i_x]), toi(row[i_y]), toi(row[i_dx]), toi(row[i_dy]))
+                    if None not in vals:
+                        x, y, dx, dy = vals
+                        ok = True
+                e_fid.append(fid); e_t.append(t); e_type.append(k)
+                e_x.append(x); e_y.append(y); e_dx.append(dx); e_dy.append(dy); e_ok.append(ok)
+
+    f_order = np.argsort(np.asarray(f_fid, dtype=np.int64), kind="stable")
+    e_order = np.lexsort((np.asarray(e_t, dtype=np.float64), np.asarray(e_fid, dtype=np.int64)))
+    # id и координаты — int64: битые значения вроде frame_id=3000000000 должны дойти до проверок (E01),
+    # а не уронить загрузку переполнением int32
+    frames = Frames(_take(f_fid, f_order, "int64"), _take(f_t, f_order, "float64"), _take(f_path, f_order))
+    events = Events(
+        _take(e_fid, e_order, "int64"), _take(e_t, e_order, "float64"), _take(e_type, e_order, "int32"),
+        list(etype_ids),
+        *(_take(c, e_order, "int64") for c in (e_x, e_y, e_dx, e_dy)),
+        _take(e_ok, e_order, "bool"),
+    )
     return frames, events
 
 
-def check_frames(frames: List[FrameRow]) -> List[str]:
+def check_frames(frames: Frames) -> List[str]:
     errs: List[str] = []
-    if not frames:
+    n = len(frames.fid)
+    if not n:
         errs.append("[F01] В CSV нет ни одного кадра (row_type=frame)")
         return errs
 
-    # id подряд 1..N
-    for i, fr in enumerate(frames, start=1):
-        if fr.fid != i:
-            errs.append(f"[F02] Непрерывность frame_id нарушена: ожидали {i}, увидели {fr.fid}")
-            break
+    fid, t = frames.fid, frames.t
+    bad = np.flatnonzero(fid != np.arange(1, n + 1))
+    i_id = int(bad[0]) if bad.size else None
+    bad = np.flatnonzero(np.diff(t) < -1e-6)
+    i_t = int(bad[0]) if bad.size else None
 
+    # id подряд 1..N
+    if i_id is not None:
+        errs.append(f"[F02] Непрерывность frame_id нарушена: ожидали {i_id + 1}, увидели {fid[i_id]}")
     # время монотонно и возрастает
-    for prev, cur in zip(frames, frames[1:]):
-        if cur.t < prev.t - 1e-6:
-            errs.append(f"[F03] Невозрастающее время кадров: frame {prev.fid} @ {prev.t:.6f} > frame {cur.fid} @ {cur.t:.6f}")
-            break
-
+    if i_t is not None:
+        errs.append(f"[F03] Невозрастающее время кадров: frame {fid[i_t]} @ {t[i_t]:.6f} > "
+                    f"frame {fid[i_t + 1]} @ {t[i_t + 1]:.6f}")
     return errs
 
 
-def check_events_vs_frames(frames: List[FrameRow], events: List[EventRow]) -> Tuple[List[str], List[str]]:
+def _frame_times(frames: Frames, fids: np.ndarray) -> np.ndarray:
+    """Время кадров с данными fid; fid, которого нет среди кадров, — NaN.
+
+    Поиск по отсортированному frames.fid, а не таблица размером с последний fid:
+    битый frame_id=1500000000 не должен стоить гигабайтов памяти. При повторах fid берём последний кадр.
+    """
+    ffid = frames.fid
+    i = np.maximum(np.searchsorted(ffid, fids, side="right") - 1, 0)
+    return np.where(ffid[i] == fids, frames.t[i], np.nan)
+
+
+def _check_event(fid: int, t: float, t_cur: float, t_next: float, last_fid: int,
+                 errs: List[str], warns: List[str]) -> None:
+    if fid < 1 or fid > last_fid:
+        errs.append(f"[E01] event с недопустимым frame_id={fid} (последний кадр {last_fid})")
+        return
+    # верхняя граница
+    if fid < last_fid:
+        if t > t_next + 1e-6:
+            errs.append(
+                f"[E02] event @ {t:.6f} с frame_id={fid} ПОСЛЕ времени следующего кадра (t_next={t_next:.6f})"
+            )
+    # нижняя граница (кроме frame 1 допускаем предупреждение)
+    if fid > 1 and t < t_cur - 1e-6:
+        errs.append(
+            f"[E03] event @ {t:.6f} с frame_id={fid} РАНЬШЕ времени своего кадра (t_frame={t_cur:.6f})"
+        )
+    if fid == 1 and t < t_cur - 1e-6:
+        warns.append(
+            f"[W10] Ранний event до первого кадра: t_event={t:.6f} < t_frame1={t_cur:.6f} (это допустимо, если действия были до первого снимка)"
+        )
+
+
+def check_events_vs_frames(frames: Frames, events: Events) -> Tuple[List[str], List[str]]:
     errs: List[str] = []
     warns: List[str] = []
 
-    if not frames:
+    if not len(frames.fid):
         errs.append("[E00] Нельзя проверить события без кадров")
         return errs, warns
 
-    frame_times = {fr.fid: fr.t for fr in frames}
-    last_fid = frames[-1].fid
+    last_fid = int(frames.fid[-1])
 
     # верхняя граница для событий: event(fid=k).t ≤ t(frame k+1)
-    for ev in events:
-        if ev.fid < 1 or ev.fid > last_fid:
-            errs.append(f"[E01] event с недопустимым frame_id={ev.fid} (последний кадр {last_fid})")
-            continue
-        # верхняя граница
-        if ev.fid < last_fid:
-            t_next = frame_times[ev.fid + 1]
-            if ev.t > t_next + 1e-6:
-                errs.append(
-                    f"[E02] event @ {ev.t:.6f} с frame_id={ev.fid} ПОСЛЕ времени следующего кадра (t_next={t_next:.6f})"
-                )
-        # нижняя граница (кроме frame 1 допускаем предупреждение)
-        t_cur = frame_times[ev.fid]
-        if ev.fid > 1 and ev.t < t_cur - 1e-6:
-            errs.append(
-                f"[E03] event @ {ev.t:.6f} с frame_id={ev.fid} РАНЬШЕ времени своего кадра (t_frame={t_cur:.6f})"
-            )
-        if ev.fid == 1 and ev.t < t_cur - 1e-6:
-            warns.append(
-                f"[W10] Ранний event до первого кадра: t_event={ev.t:.6f} < t_frame1={t_cur:.6f} (это допустимо, если действия были до первого снимка)"
-            )
+    if not len(events.fid) or last_fid < 1:
+        for fid, t in zip(events.fid, events.t):  # здесь все события — E01, времена кадров не нужны
+            _check_event(int(fid), float(t), math.nan, math.nan, last_fid, errs, warns)
+        return errs, warns
 
+    ev_fid, ev_t = events.fid, events.t
+    bad_fid = (ev_fid < 1) | (ev_fid > last_fid)
+    k = np.where(bad_fid, 1, ev_fid)
+    t_cur = _frame_times(frames, k)
+    t_next = np.where(k < last_fid, _frame_times(frames, k + 1), np.inf)
+    # E01 | E02 | (E03 или W10)
+    flagged = bad_fid | (ev_t > t_next + 1e-6) | (ev_t < t_cur - 1e-6)
+    # сообщения собираем только для помеченных событий, в исходном порядке
+    for i in np.flatnonzero(flagged):
+        _check_event(int(ev_fid[i]), float(ev_t[i]), float(t_cur[i]), float(t_next[i]), last_fid, errs, warns)
     return errs, warns
 
 
-def check_mouse_deltas(events: List[EventRow]) -> Tuple[List[str], int]:
-    errs: List[str] = []
-    n_checked = 0
-    last_pos: Optional[Tuple[int, int]] = None
-    for ev in events:
-        if not ev.etype.startswith("mouse"):
-            continue
-        try:
-            x = int(ev.payload.get("x")) if ev.payload.get("x") not in (None, "") else None
-            y = int(ev.payload.get("y")) if ev.payload.get("y") not in (None, "") else None
-            dx = int(ev.payload.get("dx")) if ev.payload.get("dx") not in (None, "") else None
-            dy = int(ev.payload.get("dy")) if ev.payload.get("dy") not in (None, "") else None
-        except Exception:
-            continue
-        if x is None or y is None or dx is None or dy is None:
-            continue
-        expected_dx = 0 if last_pos is None else x - last_pos[0]
-        expected_dy = 0 if last_pos is None else y - last_pos[1]
-        if dx != expected_dx or dy != expected_dy:
-            errs.append(
-                f"[M01] Несовпадение dx,dy на t={ev.t:.6f}: было ({dx},{dy}), ожидали ({expected_dx},{expected_dy}) при переходе {last_pos}→({x},{y})"
-            )
-        last_pos = (x, y)
-        n_checked += 1
-    return errs, n_checked
+def _mouse_delta_err(t: float, dx: int, dy: int, exp_dx: int, exp_dy: int,
+                     last_pos: Optional[Tuple[int, int]], x: int, y: int) -> str:
+    return (f"[M01] Несовпадение dx,dy на t={t:.6f}: было ({dx},{dy}), ожидали ({exp_dx},{exp_dy}) "
+            f"при переходе {last_pos}→({x},{y})")
+
 
+def check_mouse_deltas(events: Events) -> Tuple[List[str], int]:
+    errs: List[str] = []
 
-def check_images_exist_and_shape(rec_dir: Path, frames: List[FrameRow], sample: int = 0) -> Tuple[List[str], Optional[Tuple[int,int]]]:
+    sel = np.flatnonzero(events.mouse_ok)
+    if not sel.size:
+        return errs, 0
+    t, x, y, dx, dy = (c[sel] for c in (events.t, events.x, events.y, events.dx, events.dy))
+    exp_dx = np.empty_like(x); exp_dx[0] = 0; exp_dx[1:] = np.diff(x)
+    exp_dy = np.empty_like(y); exp_dy[0] = 0; exp_dy[1:] = np.diff(y)
+    # строки форматируем только для несовпадений
+    for i in np.flatnonzero((dx != exp_dx) | (dy != exp_dy)):
+        last_pos = None if i == 0 else (int(x[i-1]), int(y[i-1]))
+        errs.append(_mouse_delta_err(float(t[i]), int(dx[i]), int(dy[i]), int(exp_dx[i]), int(exp_dy[i]),
+                                     last_pos, int(x[i]), int(y[i])))
+    return errs, int(sel.size)
+
+
+def _load_pil():
+    """PIL.Image или None; импортируем только когда реально читаем кадры (--check-images, sample≠0)."""
+    try:
+        from PIL import Image  # type: ignore
+    except Exception:  # Pillow optional
+        return None
+    return Image
+
+
+def _probe_image(fpath: Path) -> Tuple[Optional[Tuple[int, int]], Optional[Exception]]:
+    from PIL import Image  # type: ignore  # уже загружен в _load_pil
+    try:
+        with Image.open(fpath) as im:
+            return im.size, None  # (w,h)
+    except Exception as e:
+        return None, e
+
+
+def check_images_exist_and_shape(rec_dir: Path, frames: Frames, sample: int = 0) -> Tuple[List[str], Optional[Tuple[int,int]]]:
     errs: List[str] = []
-    # проверка существования
-    for fr in frames:
-        fpath = rec_dir / fr.path
-        if not fpath.exists():
-            errs.append(f"[I01] Файл кадра не найден: {fr.path}")
-    if Image is None or sample == 0:
+    paths = frames.path
+    # проверка существования: один os.scandir на каталог вместо stat на каждый кадр
+    listings: Dict[str, set] = {}
+
+    def present(rel: str) -> bool:
+        d, name = os.path.split(rel)
+        names = listings.get(d)
+        if names is None:
+            try:
+                with os.scandir(rec_dir / d) as it:
+                    names = {e.name for e in it}
+            except OSError:
+                names = set()
+            listings[d] = names
+        return name in names
+
+    # frames.mkv#N — кадр внутри видеофайла
+    containers: Dict[str, bool] = {}
+    for path in paths:
+        if "#" in path:
+            cpath = path.split("#", 1)[0]
+            if cpath not in containers:
+                containers[cpath] = present(cpath)
+                if not containers[cpath]:
+                    errs.append(f"[I01] Файл кадров не найден: {cpath}")
+            continue
+        if not present(path):
+            errs.append(f"[I01] Файл кадра не найден: {path}")
+    if containers:
+        paths = [p for p in paths if "#" not in p]
+    if sample == 0 or _load_pil() is None:
         return errs, None
 
     # проверим форму на первых `sample` и последних `sample` кадрах (или на всех, если sample<0)
-    idxs = list(range(len(frames)))
-    if sample > 0 and len(frames) > 2*sample:
-        idxs = list(range(sample)) + list(range(len(frames)-sample, len(frames)))
+    idxs = list(range(len(paths)))
+    if sample > 0 and len(paths) > 2*sample:
+        idxs = list(range(sample)) + list(range(len(paths)-sample, len(paths)))
+
+    # открытие файлов — чистый I/O, читаем заголовки параллельно; результаты разбираем по порядку
+    probe_paths = [paths[i] for i in idxs]
+    workers = max(1, min(16, (os.cpu_count() or 1) * 4, len(probe_paths)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda p: _probe_image(rec_dir / p), probe_paths))
 
     ref_size: Optional[Tuple[int,int]] = None
-    for i in idxs:
-        fr = frames[i]
-        fpath = rec_dir / fr.path
-        try:
-            with Image.open(fpath) as im:
-                size = im.size  # (w,h)
-        except Exception as e:
-            errs.append(f"[I02] Ошибка чтения изображения {fr.path}: {e}")
+    for path, (size, err) in zip(probe_paths, results):
+        if err is not None:
+            errs.append(f"[I02] Ошибка чтения изображения {path}: {err}")
             continue
         if ref_size is None:
             ref_size = size
         elif size != ref_size:
-            errs.append(f"[I03] Непостоянный размер кадров: {fr.path} имеет {size}, ожидали {ref_size}")
+            errs.append(f"[I03] Непостоянный размер кадров: {path} имеет {size}, ожидали {ref_size}")
     return errs, ref_size
 
 
-def summarize(frames: List[FrameRow], events: List[EventRow], meta: dict) -> str:
-    N = len(frames)
-    M = len(events)
+def summarize(frames: Frames, events: Events, meta: dict) -> str:
+    N = len(frames.fid)
+    M = len(events.fid)
     if N == 0:
         return "Нет кадров — сводка недоступна"
 
-    # интервал между кадрами
-    gaps = [b.t - a.t for a,b in zip(frames, frames[1:])]
-    avg_gap = sum(gaps)/len(gaps) if gaps else float('nan')
-    fps_est = (1.0/avg_gap) if gaps and avg_gap>0 else float('nan')
-
-    # события по кадрам
-    per_frame = Counter([ev.fid for ev in events])
-    min_e = min(per_frame.values()) if per_frame else 0
-    max_e = max(per_frame.values()) if per_frame else 0
-    avg_e = (sum(per_frame.values())/N) if per_frame else 0.0
+    # интервал между кадрами: сумма разностей соседних = последний − первый
+    avg_gap = (float(frames.t[-1]) - float(frames.t[0])) / (N - 1) if N > 1 else float('nan')
+    fps_est = (1.0/avg_gap) if N > 1 and avg_gap>0 else float('nan')
+
+    # события по кадрам (только кадры, у которых есть события)
+    min_e = max_e = 0
+    # np.unique, а не bincount: bincount выделил бы массив до максимального fid, и одна битая строка
+    # с frame_id=1500000000 роняла бы сводку вместо ошибки E01
+    per_frame = np.unique(events.fid, return_counts=True)[1]
+    if per_frame.size:
+        min_e, max_e = int(per_frame.min()), int(per_frame.max())
+    # при равных счётчиках most_common сохраняет порядок вставки — вставляем в порядке первого появления
+    # типа среди отсортированных событий, как Counter по событиям
+    uniq, first, counts = np.unique(events.etype, return_index=True, return_counts=True)
+    types = Counter({events.etypes[k]: c for _, k, c in sorted(zip(first.tolist(), uniq.tolist(), counts.tolist()))})
+    avg_e = (M/N) if M else 0.0
 
     # события по типам
-    types = Counter([ev.etype for ev in events])
     types_str = ", ".join([f"{k}:{v}" for k,v in types.most_common()]) if types else "—"
 
     fps_target = meta.get("fps_target")
@@ -272,36 +392,40 @@ def main():
     m_errs, n_m = check_mouse_deltas(events)
     all_errs += m_errs
 
+    # весь отчёт собираем в список строк и выводим одним write
+    out: List[str] = []
+
     # 4) изображения
     if args.check_images:
         img_errs, ref_size = check_images_exist_and_shape(rec_dir, frames, sample=args.sample_frames)
         all_errs += img_errs
         if ref_size:
-            print(f"Базовый размер кадров: {ref_size[0]}x{ref_size[1]}")
+            out.append(f"Базовый размер кадров: {ref_size[0]}x{ref_size[1]}")
 
     # Сводка
-    print("==== СВОДКА ====")
-    print(summarize(frames, events, meta))
+    out.append("==== СВОДКА ====")
+    out.append(summarize(frames, events, meta))
     if n_m:
-        print(f"Проверено мышиных событий (dx,dy): {n_m}")
+        out.append(f"Проверено мышиных событий (dx,dy): {n_m}")
 
     # Предупреждения и ошибки
     if all_warns:
-        print("\n---- ПРЕДУПРЕЖДЕНИЯ ----")
-        for w in all_warns[:50]:
-            print(w)
+        out.append("\n---- ПРЕДУПРЕЖДЕНИЯ ----")
+        out += all_warns[:50]
         if len(all_warns) > 50:
-            print(f"... и ещё {len(all_warns)-50} предупреждений")
+            out.append(f"... и ещё {len(all_warns)-50} предупреждений")
 
     if all_errs:
-        print("\n**** ОШИБКИ НАЙДЕНЫ ****")
-        for e in all_errs[:200]:
-            print(e)
+        out.append("\n**** ОШИБКИ НАЙДЕНЫ ****")
+        out += all_errs[:200]
         if len(all_errs) > 200:
-            print(f"... и ещё {len(all_errs)-200} ошибок")
-        exit(2)
+            out.append(f"... и ещё {len(all_errs)-200} ошибок")
     else:
-        print("\nОК: нарушений не обнаружено")
+        out.append("\nОК: нарушений не обнаружено")
+
+    sys.stdout.write("\n".join(out) + "\n")
+    if all_errs:
+        exit(2)
 
 
 if __name__ == "__main__":
@@ -1,82 +1,422 @@
-from dataclasses import dataclass
-from typing import Dict, Tuple, Optional, Callable
-import pyautogui
+import ctypes
+import importlib
+import os
+import queue
+import threading
+from typing import ClassVar, NamedTuple, Sequence, Tuple, Optional, Callable
 
+# quartz — настоящий ввод; noop — Quartz и AppKit не импортируются, исполнитель ничего не постит (CI, тесты).
+# Касается только исполнителя: agentic_envs всё равно снимает экран через mss и берёт размер из pyautogui
+BACKEND = os.environ.get("SSSCUA_EXECUTOR_BACKEND", "quartz").strip().lower()
 
-# pyautogui.FAILSAFE = True
-# pyautogui.PAUSE = 0
 
+# виртуальные коды клавиш macOS (kVK_* из Carbon/HIToolbox)
+KEYCODES = {
+    'space': 0x31, 'enter': 0x24, 'tab': 0x30, 'esc': 0x35,
+    'up': 0x7E, 'down': 0x7D, 'left': 0x7B, 'right': 0x7C,
+    'c': 0x08, 'v': 0x09,
+    'command': 0x37, 'option': 0x3A, 'ctrl': 0x3B, 'shift': 0x38,
+}
+WRITE_ID = 13  # key_id печати текста — единственное действие, которому нужен spec.text
+NOOP_ID = 18  # key_id «ничего не делать»
+UNICODE_CHUNK = 20  # UTF-16 единиц на одно клавиатурное событие — больше macOS не доставляет
+# текст печатаем пачками по UNICODE_CHUNK; от стольких символов дешевле вставить через буфер (Cmd+V)
+PASTE_MIN_CHARS = 200
+QOS_CLASS_USER_INTERACTIVE = 0x21  # <sys/qos.h>
 
-@dataclass
-class ActionSpec:
-    mouse_delta: Tuple[int, int]
+# Аварийная остановка, как pyautogui.FAILSAFE, но без лишнего запроса позиции на каждый вызов:
+# проверяем позицию, которую move_rel/click и так читают. Курсор в углу экрана → stop()
+FAILSAFE = True
+
+Quartz = None  # модули pyobjc; импортирует _load_quartz() при создании первого MacExecutor
+AppKit = None
+_SRC = None  # общий CGEventSource для всех создаваемых событий; создаёт _load_quartz()
+MODIFIER_FLAGS = {}  # имя модификатора -> бит CGEventFlags; заполняет _load_quartz()
+_CLOSE = object()  # метка close(): поток-исполнитель выходит из цикла
+_RELEASE = object()  # метка release_all()/stop(): отпустить модификаторы из потока-исполнителя
+
+
+class FailSafeException(Exception):
+    pass
+
+
+def _post(ev, flags: int = 0):
+    Quartz.CGEventSetFlags(ev, flags)
+    Quartz.CGEventPost(Quartz.kCGHIDEventTap, ev)
+
+
+def _combo(modifier: str, key: str) -> Tuple[tuple, ...]:
+    """Готовая последовательность (событие, добавочные флаги) для modifier+key."""
+    mod = MODIFIER_FLAGS[modifier]
+    down = lambda code: Quartz.CGEventCreateKeyboardEvent(_SRC, code, True)
+    up = lambda code: Quartz.CGEventCreateKeyboardEvent(_SRC, code, False)
+    return ((down(KEYCODES[modifier]), mod), (down(KEYCODES[key]), mod),
+            (up(KEYCODES[key]), mod), (up(KEYCODES[modifier]), 0))
+
+
+def _load_quartz():
+    """Импорт Quartz/AppKit — при создании первого MacExecutor, а не при импорте
+    модуля: сам импорт pyobjc небыстрый и без оконного сервера не работает."""
+    global Quartz, AppKit, _SRC
+    if Quartz is not None:
+        return
+    # Quartz (pyobjc) напрямую, без pyautogui: у него после каждого CGEventPost ещё sleep(0.01)
+    # «чтобы система успела», плюс разбор строк клавиш на каждый вызов
+    Quartz = importlib.import_module("Quartz")
+    AppKit = importlib.import_module("AppKit")
+
+    # один источник на весь процесс вместо неявного нового при каждом CGEventCreate*(None, …);
+    # освобождать вручную не нужно — pyobjc держит счётчик ссылок
+    _SRC = Quartz.CGEventSourceCreate(Quartz.kCGEventSourceStateHIDSystemState)
+    MODIFIER_FLAGS.update(command=Quartz.kCGEventFlagMaskCommand, option=Quartz.kCGEventFlagMaskAlternate,
+                          ctrl=Quartz.kCGEventFlagMaskControl, shift=Quartz.kCGEventFlagMaskShift)
+
+
+def _utf16_chunks(text: str):
+    """Куски text по ≤ UNICODE_CHUNK единиц UTF-16 (суррогатные пары не разрываем): (кусок, длина)."""
+    if len(text.encode('utf-16-le')) == 2 * len(text):  # всё в BMP — режем срезами
+        for i in range(0, len(text), UNICODE_CHUNK):
+            part = text[i:i + UNICODE_CHUNK]
+            yield part, len(part)
+        return
+    chunk, n = [], 0
+    for ch in text:
+        w = 2 if ord(ch) > 0xFFFF else 1
+        if n + w > UNICODE_CHUNK:
+            yield "".join(chunk), n
+            chunk, n = [], 0
+        chunk.append(ch)
+        n += w
+    if chunk:
+        yield "".join(chunk), n
+
+
+def _raise_thread_priority():
+    """Поднять QoS текущего (постящего события) потока до USER_INTERACTIVE, чтобы ввод не отставал, когда
+    политика и симулятор грузят CPU. Лучшее усилие: если не вышло — работаем с обычным приоритетом."""
+    try:
+        libc = ctypes.CDLL("/usr/lib/libSystem.dylib")
+        libc.pthread_set_qos_class_self_np(QOS_CLASS_USER_INTERACTIVE, 0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _mouse_pos() -> Tuple[float, float]:
+    p = Quartz.CGEventGetLocation(Quartz.CGEventCreate(_SRC))
+    return p.x, p.y
+
+
+# --- действия: фабрики функций вида f(executor) для таблицы MacExecutor._ACTIONS ---
+# клавиатурные действия постят готовые шаблоны событий своего исполнителя (ex._key_down/_key_up)
+def _click_action(down_type: int, up_type: int, button: int, clicks: int = 1):
+    def action(ex):
+        ex.click(down_type, up_type, button, clicks)
+    return action
+
+
+# Переключатель удержания: первое срабатывание — keyDown, второе — keyUp
+def _toggle_action(key: str):
+    bit = MODIFIER_FLAGS[key]
+
+    def action(ex):
+        ex._mod_flags ^= bit
+        _post((ex._key_down if ex._mod_flags & bit else ex._key_up)[key], ex._mod_flags)
+    return action
+
+
+def _press_action(key: str):
+    def action(ex):
+        flags = ex._mod_flags
+        _post(ex._key_down[key], flags)
+        _post(ex._key_up[key], flags)
+    return action
+
+
+def _copy_action(ex):
+    ex.post_sequence(ex._copy_seq)
+
+
+def _paste_action(ex):
+    ex.post_sequence(ex._paste_seq)
+
+
+def _noop_action(ex):
+    pass
+
+
+# поля плоские: без вложенного кортежа mouse_delta и его распаковки на каждый шаг;
+# строка массива (N, 3) int траектории — это как раз (dx, dy, key_id), apply_batch принимает такой массив
+class ActionSpec(NamedTuple):
+    dx: int
+    dy: int
     key_id: int
     text: Optional[str] = None
 
 
+# индекс = key_id; элементы — обычные функции f(executor), без замыканий на self
+def _build_actions() -> Tuple[Optional[Callable[["MacExecutor"], None]], ...]:
+    left = (Quartz.kCGEventLeftMouseDown, Quartz.kCGEventLeftMouseUp, Quartz.kCGMouseButtonLeft)
+    right = (Quartz.kCGEventRightMouseDown, Quartz.kCGEventRightMouseUp, Quartz.kCGMouseButtonRight)
+    return (
+        # --- мышь ---
+        _click_action(*left),            # 0
+        _click_action(*right),           # 1
+        _click_action(*left, clicks=2),  # 2
+
+        # --- модификаторы с toggle ---
+        _toggle_action('command'),  # 3
+        _toggle_action('option'),   # 4
+        _toggle_action('ctrl'),     # 5
+        _toggle_action('shift'),    # 6
+
+        # --- простые клавиши ---
+        _press_action('space'),     # 7
+        _press_action('enter'),     # 8
+        _press_action('tab'),       # 9
+        _press_action('esc'),       # 10
+
+        # --- комбинации ---
+        _copy_action,               # 11 copy
+        _paste_action,              # 12 paste
+
+        # --- печать текста ---
+        None,                       # 13 write_text — WRITE_ID, разбирается в _dispatch отдельно
+
+        # --- стрелки ---
+        _press_action('up'),        # 14
+        _press_action('down'),      # 15
+        _press_action('left'),      # 16
+        _press_action('right'),     # 17
+
+        # --- ничего не делать ---
+        _noop_action,               # 18
+    )
+
+
 class MacExecutor:
+    # таблица действий общая для всех экземпляров; собирается при создании первого из них
+    _ACTIONS: ClassVar[Tuple[Optional[Callable[["MacExecutor"], None]], ...]] = ()
+
     def __init__(self):
-        self.held_keys = set()
-
-        self._actions: Dict[int, Callable[[Optional[str]], None]] = {
-            # --- мышь ---
-            0: lambda _: pyautogui.click(button='left'),
-            1: lambda _: pyautogui.click(button='right'),
-            2: lambda _: pyautogui.doubleClick(),
-
-            # --- модификаторы с toggle ---
-            3: lambda _: self.toggle_key('command'),
-            4: lambda _: self.toggle_key('option'),
-            5: lambda _: self.toggle_key('ctrl'),
-            6: lambda _: self.toggle_key('shift'),
-
-            # --- простые клавиши ---
-            7: lambda _: pyautogui.press('space'),
-            8: lambda _: pyautogui.press('enter'),
-            9: lambda _: pyautogui.press('tab'),
-            10: lambda _: pyautogui.press('esc'),
-
-            # --- комбинации ---
-            11: lambda _: pyautogui.hotkey('command', 'c'),  # copy
-            12: lambda _: pyautogui.hotkey('command', 'v'),  # paste
-
-            # --- печать текста ---
-            13: lambda t: pyautogui.write(t or ""),          # write_text
-
-            # --- стрелки ---
-            14: lambda _: pyautogui.press('up'),
-            15: lambda _: pyautogui.press('down'),
-            16: lambda _: pyautogui.press('left'),
-            17: lambda _: pyautogui.press('right'),
-
-            # --- ничего не делать ---
-            18: lambda _: None,
-        }
+        self._noop = BACKEND == "noop"
+        if not MacExecutor._ACTIONS:
+            if self._noop:
+                MacExecutor._ACTIONS = (_noop_action,) * (NOOP_ID + 1)
+            else:
+                _load_quartz()
+                MacExecutor._ACTIONS = _build_actions()
+
+        self._mod_flags = 0  # зажатые модификаторы — битовая маска CGEventFlags, ровно то, что ждёт Quartz
+        # накопленное движение мыши от noop-действий, ещё не отправленное в систему
+        self._pending_dx = 0
+        self._pending_dy = 0
+        self._stopped = False  # выставляется stop() / fail-safe; дальше действия не исполняются
+        self._closed = False  # выставляется close(): потока-исполнителя больше нет
+
+        if self._noop:
+            self._screen = (0, 0)  # экрана нет; move_rel/click в этом режиме ничего не делают
+        else:
+            display = Quartz.CGMainDisplayID()
+            self._screen = (Quartz.CGDisplayPixelsWide(display), Quartz.CGDisplayPixelsHigh(display))
+            # шаблоны событий у каждого исполнителя свои: _post меняет на них флаги, а постит их
+            # только поток этого исполнителя — чужие флаги в событие не попадут
+            key_event = Quartz.CGEventCreateKeyboardEvent
+            self._key_down = {k: key_event(_SRC, code, True) for k, code in KEYCODES.items()}
+            self._key_up = {k: key_event(_SRC, code, False) for k, code in KEYCODES.items()}
+            self._copy_seq = _combo('command', 'c')   # Cmd+C
+            self._paste_seq = _combo('command', 'v')  # Cmd+V
+
+        # события постит отдельный поток: apply() только кладёт spec в очередь и сразу возвращается
+        self._q: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._worker = threading.Thread(target=self._run, name="MacExecutor", daemon=True)
+        self._worker.start()
 
     @property
     def n_discrete(self) -> int:
-        return len(self._actions)
+        return len(self._ACTIONS)
 
-    # Переключатель удержания: первый вызов — keyDown, второй — keyUp
-    def toggle_key(self, key: str):
-        if key not in self.held_keys:
-            pyautogui.keyDown(key, _pause=False)
-            self.held_keys.add(key)
-        else:
-            pyautogui.keyUp(key, _pause=False)
-            self.held_keys.remove(key)
+    # post_sequence / write / click / move_rel постят события — их зовёт поток-исполнитель;
+    # снаружи действия подаются через apply()
+    def post_sequence(self, seq: Tuple[tuple, ...]):
+        if self._noop:
+            return
+        flags = self._mod_flags
+        for ev, mask in seq:
+            _post(ev, flags | mask)
+
+    def write(self, text: str):
+        if not text or self._noop:
+            return
+        if len(text) >= PASTE_MIN_CHARS:
+            # очень длинный текст — за O(1): кладём в буфер обмена и жмём Cmd+V (содержимое буфера затирается)
+            pb = AppKit.NSPasteboard.generalPasteboard()
+            pb.clearContents()
+            pb.setString_forType_(text, AppKit.NSPasteboardTypeString)
+            self.post_sequence(self._paste_seq)
+            return
+        # иначе — одно нажатие (down+up) на кусок, каждое несёт до UNICODE_CHUNK символов
+        flags = self._mod_flags
+        for part, n in _utf16_chunks(text):
+            for down in (True, False):
+                ev = Quartz.CGEventCreateKeyboardEvent(_SRC, 0, down)
+                Quartz.CGEventKeyboardSetUnicodeString(ev, n, part)
+                _post(ev, flags)
+
+    def _check_failsafe(self, x: float, y: float):
+        w, h = self._screen
+        if FAILSAFE and (x <= 0 or x >= w - 1) and (y <= 0 or y >= h - 1):
+            self.stop()
+            raise FailSafeException(f"курсор в углу экрана ({x:.0f}, {y:.0f}) — исполнитель остановлен")
+
+    def click(self, down_type: int, up_type: int, button: int, clicks: int = 1):
+        if self._noop:
+            return
+        pos = _mouse_pos()
+        self._check_failsafe(*pos)
+        flags = self._mod_flags
+        for n in range(1, clicks + 1):  # clickState 1, 2… — так система распознаёт двойной клик
+            for etype in (down_type, up_type):
+                ev = Quartz.CGEventCreateMouseEvent(_SRC, etype, pos, button)
+                Quartz.CGEventSetIntegerValueField(ev, Quartz.kCGMouseEventClickState, n)
+                _post(ev, flags)
+
+    def move_rel(self, dx: int, dy: int):
+        if self._noop:
+            return
+        x, y = _mouse_pos()
+        self._check_failsafe(x, y)
+        # как и pyautogui, не выводим курсор за пределы основного экрана
+        x = min(max(x + dx, 0), self._screen[0] - 1)
+        y = min(max(y + dy, 0), self._screen[1] - 1)
+        ev = Quartz.CGEventCreateMouseEvent(_SRC, Quartz.kCGEventMouseMoved, (x, y), Quartz.kCGMouseButtonLeft)
+        _post(ev, self._mod_flags)
 
     def apply(self, spec: ActionSpec):
-        dx, dy = spec.mouse_delta
+        # самый частый случай — noop без движения: даже в очередь не кладём
+        if spec.key_id == NOOP_ID and not spec.dx and not spec.dy:
+            return
+        if self._stopped or self._closed:
+            self._raise_inactive()
+        self._q.put(spec)
+
+    # Проигрывание траектории: вся пачка — один элемент очереди, движения между действиями
+    # склеиваются так же, как в apply()
+    def apply_batch(self, specs: Sequence[Sequence], texts: Optional[Sequence[Optional[str]]] = None):
+        """specs — ActionSpec'и, кортежи (dx, dy, key_id[, text]) или массив numpy (N, 3) int;
+        texts — тексты по строкам specs (нужны только строкам с WRITE_ID)."""
+        if self._stopped or self._closed:
+            self._raise_inactive()
+        if not len(specs):  # len, а не truthiness: у numpy-массива она неоднозначна
+            return
+        rows = specs.tolist() if hasattr(specs, "tolist") else specs  # numpy → обычные int
+        if texts is None:
+            batch = [r if isinstance(r, ActionSpec) else ActionSpec(*r) for r in rows]
+        else:
+            if len(texts) != len(rows):
+                raise ValueError(f"texts: {len(texts)} строк, а specs: {len(rows)}")
+            batch = [ActionSpec(r[0], r[1], r[2], t) for r, t in zip(rows, texts)]
+        self._q.put(batch)
+
+    def _raise_inactive(self):
+        if self._closed:
+            raise RuntimeError("исполнитель закрыт (close()); нужен новый MacExecutor")
+        raise FailSafeException("исполнитель остановлен (stop() или fail-safe); продолжить — resume()")
+
+    def _run(self):
+        if not self._noop:  # в noop-режиме поток почти ничего не делает — приоритет ему ни к чему
+            _raise_thread_priority()
+        q = self._q
+        while True:
+            item = q.get()
+            if item is _CLOSE:
+                return
+            try:
+                if isinstance(item, ActionSpec):
+                    self._dispatch(item)
+                elif item is _RELEASE:
+                    self._release_modifiers()
+                elif isinstance(item, list):  # apply_batch
+                    dispatch = self._dispatch
+                    for spec in item:
+                        dispatch(spec)
+                else:  # метка flush(): всё до неё уже отправлено
+                    try:
+                        self._flush_moves()
+                    finally:
+                        item.set()  # что бы ни случилось, flush() не должен зависнуть
+            except Exception as e:
+                print(f"[WARN] executor: {e}")
+
+    def _dispatch(self, spec: ActionSpec):
+        # всё, что успело встать в очередь до остановки, выбрасываем; в noop-режиме — всё вообще
+        if self._stopped or self._noop:
+            return
+        dx, dy, key_id = spec.dx, spec.dy, spec.key_id
+        if key_id == NOOP_ID:
+            # чистое движение копим: уйдёт одним событием перед следующим действием или во flush()
+            self._pending_dx += dx
+            self._pending_dy += dy
+            return
+
+        dx += self._pending_dx
+        dy += self._pending_dy
+        self._pending_dx = self._pending_dy = 0
         if dx or dy:
-            pyautogui.moveRel(dx, dy, _pause=False)
+            self.move_rel(dx, dy)
+
+        if key_id == WRITE_ID:
+            self.write(spec.text or "")
+        elif 0 <= key_id < len(self._ACTIONS):
+            self._ACTIONS[key_id](self)
+
+    # Дождаться, пока поток отправит всё поставленное в очередь, включая накопленное движение мыши
+    # (конец шага / перед снимком экрана)
+    def flush(self):
+        if self._closed:  # поток уже завершён — ждать некого, а модификаторы отпустил close()
+            return
+        done = threading.Event()
+        self._q.put(done)
+        done.wait()
 
-        action_fn = self._actions.get(spec.key_id)
-        if action_fn is not None:
-            action_fn(spec.text)
+    def _flush_moves(self):
+        if (self._pending_dx or self._pending_dy) and not self._stopped:
+            dx, dy = self._pending_dx, self._pending_dy
+            self._pending_dx = self._pending_dy = 0
+            try:
+                self.move_rel(dx, dy)
+            except FailSafeException as e:  # stop() уже вызван — движение просто не отправляем
+                print(f"[WARN] executor: {e}")
 
     def release_all(self):
-        for key in list(self.held_keys):
-            pyautogui.keyUp(key, _pause=False)
-        self.held_keys.clear()
+        if self._closed:
+            return
+        self._q.put(_RELEASE)
+        self.flush()
+
+    def _release_modifiers(self):
+        if not self._mod_flags:  # обычный случай на границе эпизода: ничего не зажато
+            return
+        for key, bit in MODIFIER_FLAGS.items():
+            if self._mod_flags & bit:
+                self._mod_flags &= ~bit
+                _post(self._key_up[key], self._mod_flags)
+
+    def close(self):
+        """Отпустить модификаторы и завершить поток-исполнитель; повторный вызов ничего не делает."""
+        if self._closed:
+            return
+        self.release_all()
+        self._closed = True
+        self._q.put(_CLOSE)
+        self._worker.join()
+
+    def stop(self):
+        """Аварийная остановка: очередь дальше не исполняется, зажатые модификаторы отпускаются.
+        Можно звать из любого потока (сами события отпускания постит поток-исполнитель);
+        apply() после этого бросает FailSafeException."""
+        self._stopped = True
+        self._pending_dx = self._pending_dy = 0
+        self._q.put(_RELEASE)
 
+    def resume(self):
+        self._stopped = False